@@ -1,44 +1,48 @@
 import os
 import sys
+import mmap
+import struct
+import logging
 import argparse
 from pathlib import Path
 from psd_tools import PSDImage
-from contextlib import contextmanager
-
-
-@contextmanager
-def suppress_console_output():
-    devnull = open(os.devnull, "w")
-    old_stdout = sys.stdout
-    old_stderr = sys.stderr
-    try:
-        sys.stdout = devnull
-        sys.stderr = devnull
-        yield
-    finally:
-        sys.stdout = old_stdout
-        sys.stderr = old_stderr
-        devnull.close()
-
-
-def write_font_to_file(font, output_file, allow_duplicates=False):
-    output_file = Path(output_file)
-
-    if not output_file.exists():
-        try:
-            output_file.touch()
-        except IOError as e:
-            print(f"Error creating file {output_file}: {e}")
-            return
-
-    known_fonts = read_fonts_from_file(output_file)
-
-    if not allow_duplicates and font in known_fonts:
+from psd_tools.constants import Tag
+from psd_tools.psd.header import FileHeader
+from psd_tools.psd.layer_and_mask import LayerAndMaskInformation, LayerRecords
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# We're silencing psd_tools' logging because of some ugly errors that get thrown
+#
+# Example:
+# Unknown image resource 1092
+# Unknown key: b'CAI '
+# Unknown tagged block: b'CAI ', b'\x00\x00\x00\x03\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00 ... =77'
+# Unknown key: b'OCIO'
+# Unknown tagged block: b'OCIO', b'\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00\x00\x1bdo ... =170'
+# Unknown key: b'GenI'
+# Unknown tagged block: b'GenI', b'\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00\x00\x0bge ... =55'
+#
+# Cause:
+# New resources introduced in the recent versions of Photoshop that have no known documentation
+# https://github.com/psd-tools/psd-tools/issues/415#issuecomment-2172064533
+#
+# The messages come from psd_tools' loggers rather than print(), so raising
+# the logger level drops them without touching stdout/stderr.
+logging.getLogger("psd_tools").setLevel(logging.CRITICAL)
+logging.getLogger("psd_tools.psd.tagged_blocks").setLevel(logging.CRITICAL)
+
+PSD_EXTENSIONS = (".psd", ".psb")
+PSD_CHUNKSIZE = 4
+PSD_PREFETCH_BYTES = 1 << 20
+
+
+def write_fonts_to_file(fonts, output_file):
+    if not fonts:
         return
 
     try:
-        with open(output_file, "a") as f:
-            f.write(f"{font}\n")
+        with open(output_file, "a", buffering=1 << 16) as f:
+            f.write("\n".join(fonts) + "\n")
     except IOError as e:
         print(f"Error writing to file {output_file}: {e}")
 
@@ -55,71 +59,190 @@ def read_fonts_from_file(output_file):
         return set()
 
 
-def find_fonts_in_psd(psd_path: Path, output_file, allow_duplicates=False):
-    fonts_found = set()
+def sanitize_font_name(font_name):
+    if isinstance(font_name, bytes):
+        font_name = font_name.decode("utf-8")
 
-    # We're suppressing the console output because of some ugly errors that get thrown
-    #
-    # Example:
-    # Unknown image resource 1092
-    # Unknown key: b'CAI '
-    # Unknown tagged block: b'CAI ', b'\x00\x00\x00\x03\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00 ... =77'
-    # Unknown key: b'OCIO'
-    # Unknown tagged block: b'OCIO', b'\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00\x00\x1bdo ... =170'
-    # Unknown key: b'GenI'
-    # Unknown tagged block: b'GenI', b'\x00\x00\x00\x10\x00\x00\x00\x01\x00\x00\x00\x00\x00\x0bge ... =55'
-    #
-    # Cause:
-    # New resources introduced in the recent versions of Photoshop that have no known documentation
-    # https://github.com/psd-tools/psd-tools/issues/415#issuecomment-2172064533
+    # engine_data strings repr with quotes, which str() picks up
+    try:
+        return str(font_name).strip("'")
+    except Exception:
+        return font_name
 
-    with suppress_console_output():
-        try:
-            psd = PSDImage.open(psd_path)
 
-            for layer in psd.descendants():
-                if layer.kind == "type":
-                    fontset = layer.resource_dict["FontSet"]
-                    runlength = layer.engine_dict["StyleRun"]["RunLengthArray"]
-                    rundata = layer.engine_dict["StyleRun"]["RunArray"]
+class _MappedFile:
+    # File-like view of an mmap for psd_tools, which needs seek() to return
+    # the new position; mmap.seek() only does that from Python 3.13 on
+    def __init__(self, mm):
+        self.mm = mm
+
+    def read(self, size=-1):
+        return self.mm.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.mm.seek(offset, whence)
+        return self.mm.tell()
+
+    def tell(self):
+        return self.mm.tell()
+
+
+def _read_layer_records(mm):
+    fp = _MappedFile(mm)
+    header = FileHeader.read(fp)
+    length_fmt = (">I", ">Q")[header.version - 1]
+    length_size = struct.calcsize(length_fmt)
+
+    # Color mode data and image resources aren't needed, so skip over them
+    for _ in range(2):
+        (length,) = struct.unpack(">I", fp.read(4))
+        fp.seek(length, os.SEEK_CUR)
+
+    section_start = fp.tell()
+    (section_length,) = struct.unpack(length_fmt, fp.read(length_size))
+    if not section_length:
+        return []
+
+    section_end = fp.tell() + section_length
+
+    # Stop after the layer records, before any channel image data
+    (layer_info_length,) = struct.unpack(length_fmt, fp.read(length_size))
+    if layer_info_length:
+        (layer_count,) = struct.unpack(">h", fp.read(2))
+        if layer_count:
+            return LayerRecords.read(fp, layer_count, "macroman", header.version)
+
+    # 16 and 32-bit documents keep their layer info in a tagged block at the
+    # end of the section instead, leaving the main layer info empty or a
+    # placeholder with no layers, which means reading all of it. Every type
+    # layer carries a TySh tagged block, so skip that if there isn't one.
+    if mm.find(b"TySh", fp.tell(), section_end) == -1:
+        return []
+
+    fp.seek(section_start)
+    layer_and_mask = LayerAndMaskInformation.read(fp, "macroman", header.version)
+    blocks = layer_and_mask.tagged_blocks
+    if blocks is not None:
+        for key in (Tag.LAYER_16, Tag.LAYER_32):
+            if key in blocks:
+                return blocks.get_data(key).layer_records or []
+
+    return []
+
 
-                    for length, style in zip(runlength, rundata):
-                        stylesheet = style["StyleSheet"]["StyleSheetData"]
-                        font = fontset[stylesheet["Font"]]
-                        font_name = font["Name"]
+def read_type_layers(mm):
+    type_layers = []
 
-                        if isinstance(font_name, bytes):
-                            font_name = font_name.decode("utf-8")
-                        found_font = font_name
+    for record in _read_layer_records(mm):
+        type_data = record.tagged_blocks.get_data(Tag.TYPE_TOOL_OBJECT_SETTING)
+        if type_data is not None:
+            engine_data = type_data.text_data.get(b"EngineData").value
+            type_layers.append(
+                (engine_data.get("EngineDict"), engine_data.get("ResourceDict"))
+            )
 
-                        try:
-                            found_font = str(found_font).strip("'")
-                        except Exception:
-                            pass
+    return type_layers
 
-                        fonts_found.add(found_font)
-                        write_font_to_file(found_font, output_file, allow_duplicates)
 
-        except Exception as e:
-            print(f"Error processing PSD {psd_path}: {e}")
+def extract_fonts(psd_path: str):
+    fonts_found = set()
+    font_names = {}
+
+    # Only the type layers' engine data is needed, so read just the layer
+    # records and skip image data. Anything the low-level walk can't handle
+    # goes through the full PSDImage parse instead.
+    #
+    # The file is memory-mapped so psd_tools' many small reads and seeks are
+    # served from the page cache rather than through buffered file reads.
+    with open(psd_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                type_layers = read_type_layers(mm)
+            except Exception:
+                mm.seek(0)
+                psd = PSDImage.open(_MappedFile(mm))
+                type_layers = [
+                    (layer.engine_dict, layer.resource_dict)
+                    for layer in psd.descendants()
+                    if layer.kind == "type"
+                ]
+
+    for engine_dict, resource_dict in type_layers:
+        fontset = resource_dict["FontSet"]
+        rundata = engine_dict["StyleRun"]["RunArray"]
+
+        # Only the distinct fonts matter, not how many runs use each one
+        font_indices = {
+            style["StyleSheet"]["StyleSheetData"]["Font"] for style in rundata
+        }
+
+        for font_index in font_indices:
+            font_name = fontset[font_index]["Name"]
+
+            # The same raw name can appear in several type layers
+            found_font = font_names.get(font_name)
+            if found_font is None:
+                found_font = sanitize_font_name(font_name)
+                font_names[font_name] = found_font
+
+            fonts_found.add(found_font)
 
     return fonts_found
 
 
-def build_psd_paths(root_dir: Path, recursive: bool = False):
-    psd_extensions = {".psd", ".psb"}
-    psd_paths = set()
+def find_fonts_in_psd(psd_path: str):
+    # Runs inside a worker process, so errors are handed back to the
+    # caller instead of being printed here.
+    try:
+        return extract_fonts(psd_path), None
+    except Exception as e:
+        return set(), str(e)
+
+
+def prefetch_psd(psd_path: str):
+    # Ask the kernel to start reading the part of the file that the workers
+    # parse into the page cache, so the worker that parses it later doesn't
+    # wait on storage. That is the header, the color mode data and image
+    # resources being skipped, and the start of the layer info where the
+    # layer records live; pixel data further in is never read.
+    if not hasattr(os, "posix_fadvise"):
+        return
 
-    if recursive:
-        for path in root_dir.glob("**/*"):
-            if path.suffix.lower() in psd_extensions:
-                psd_paths.add(path.resolve())
-    else:
-        for path in root_dir.glob("*"):
-            if path.suffix.lower() in psd_extensions:
-                psd_paths.add(path.resolve())
+    try:
+        fd = os.open(psd_path, os.O_RDONLY)
+        try:
+            offset = 26  # file header
+            for _ in range(2):
+                (length,) = struct.unpack(">I", os.pread(fd, 4, offset))
+                offset += 4 + length
 
-    return psd_paths
+            os.posix_fadvise(fd, 0, offset + PSD_PREFETCH_BYTES, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except (OSError, struct.error):
+        pass
+
+
+def _walk_psd_paths(directory, recursive):
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        yield from _walk_psd_paths(entry.path, recursive)
+                elif len(entry.name) > 4 and entry.name[-4:].lower() in PSD_EXTENSIONS:
+                    yield entry.path
+    except OSError as e:
+        print(f"Error reading directory {directory}: {e}")
+
+
+def build_psd_paths(root_dir: Path, recursive: bool = False):
+    # os.path.abspath only normalizes the string, unlike Path.resolve which
+    # stats and follows links for every match. Paths stay plain strings
+    # since everything downstream accepts them.
+    return list(
+        {os.path.abspath(path) for path in _walk_psd_paths(root_dir, recursive)}
+    )
 
 
 def main(root_dir=None, output_file=None, recursive=False, allow_duplicates=False):
@@ -134,21 +257,54 @@ def main(root_dir=None, output_file=None, recursive=False, allow_duplicates=Fals
 
     psd_paths = build_psd_paths(Path(root_dir), recursive=recursive)
     all_fonts = set()
+    new_fonts = []
+
+    known_fonts = set()
+    if Path(output_file).exists():
+        known_fonts = read_fonts_from_file(output_file)
+
+    # Parsing is CPU-bound inside psd_tools, so PSDs are parsed in worker
+    # processes; the output file is written once, from this process, after
+    # all of them are done.
+    #
+    # Workers take PSDs in order, so background threads keep prefetching up
+    # to two batches of chunks past the PSD being collected, overlapping
+    # those reads with parsing. The first batch is hinted as well, since the
+    # workers only start on it as their processes come up.
+    lookahead = (os.cpu_count() or 1) * PSD_CHUNKSIZE
+
+    with ProcessPoolExecutor() as executor, ThreadPoolExecutor(2) as prefetcher:
+        for psd_path in psd_paths[: 2 * lookahead]:
+            prefetcher.submit(prefetch_psd, psd_path)
+
+        results = executor.map(find_fonts_in_psd, psd_paths, chunksize=PSD_CHUNKSIZE)
 
-    for idx, psd_path in enumerate(psd_paths, start=1):
-        print(f"Processing PSD {idx} of {len(psd_paths)}: {psd_path}")
-        fonts_found = find_fonts_in_psd(psd_path, output_file, allow_duplicates)
-        all_fonts.update(fonts_found)
+        for idx, (psd_path, (fonts_found, error)) in enumerate(
+            zip(psd_paths, results), start=1
+        ):
+            print(f"Processing PSD {idx} of {len(psd_paths)}: {psd_path}")
+
+            if idx + 2 * lookahead <= len(psd_paths):
+                prefetcher.submit(prefetch_psd, psd_paths[idx + 2 * lookahead - 1])
+
+            if error is not None:
+                print(f"Error processing PSD {psd_path}: {error}")
+
+            for font in sorted(fonts_found):
+                if allow_duplicates or font not in known_fonts:
+                    known_fonts.add(font)
+                    new_fonts.append(font)
+
+            all_fonts.update(fonts_found)
+
+    write_fonts_to_file(new_fonts, output_file)
 
     if not all_fonts:
         print("\nNo fonts found.")
         return
 
-    all_fonts = sorted(all_fonts)
-
     print("\nFonts found:")
-    for font in all_fonts:
-        print(font)
+    sys.stdout.write("\n".join(sorted(all_fonts)) + "\n")
 
 
 if __name__ == "__main__":